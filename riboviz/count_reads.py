@@ -44,11 +44,17 @@ For example::
     WT3AT	hisat2  vignette/tmp/WT3AT/rRNA_map.sam	1373362	Reads with rRNA and other contaminating reads removed by alignment to rRNA index files
 
 """
-import glob
+import concurrent.futures
+import csv
+import logging
+import logging.handlers
+import multiprocessing
 import os
 import os.path
-import multiprocessing
+import shutil
+import subprocess
 import yaml
+import numpy as np
 import pandas as pd
 from riboviz import demultiplex_fastq
 from riboviz import fastq
@@ -60,6 +66,11 @@ from riboviz import trim_5p_mismatch
 from riboviz import workflow_files
 from riboviz.tools import demultiplex_fastq as demultiplex_fastq_tools_module
 from riboviz.tools import trim_5p_mismatch as trim_5p_mismatch_tools_module
+try:
+    # Use libyaml-based loader, if PyYAML was built with it.
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
 
 SAMPLE_NAME = "SampleName"
 """ Column name. """
@@ -75,14 +86,295 @@ HEADER = [SAMPLE_NAME, PROGRAM, FILE, NUM_READS, DESCRIPTION]
 """ File header. """
 INPUT = "input"
 """ ``Program`` value to denote input files """
+LOGGER = logging.getLogger(__name__)
+""" Logger for progress and error messages. """
+_SAMPLE_FILE_SUFFIXES = [workflow_files.ADAPTER_TRIM_FQ,
+                         workflow_files.UMI_EXTRACT_FQ]
+"""
+Suffixes of names of workflow files in sample directories (or, for
+multiplexed files, the temporary files directory).
+"""
+_SAMPLE_FILE_NAMES = [workflow_files.NON_RRNA_FQ,
+                      workflow_files.RRNA_MAP_SAM,
+                      workflow_files.UNALIGNED_FQ,
+                      workflow_files.ORF_MAP_SAM,
+                      workflow_files.ORF_MAP_CLEAN_SAM,
+                      workflow_files.TRIM_5P_MISMATCH_TSV,
+                      workflow_files.DEDUP_BAM]
+""" Names of workflow files in sample directories. """
+SAMTOOLS = "samtools"
+""" ``samtools`` command used to count reads in BAM files. """
+SAMTOOLS_THREADS = 4
+""" Number of threads ``samtools`` uses to decompress BAM files. """
+
+_COUNT_CACHE = {}
+"""
+Cache of read counts, keyed by counting function and absolute file
+name, with values tuples of file modification time, file size and
+read count.
+"""
+_TASK_COUNTS = None
+"""
+Read counts added to :py:const:`_COUNT_CACHE` by the task being run
+by :py:func:`_call_counting` in a worker process, or ``None`` if no
+such task is being run.
+"""
+
+
+class _LoggerHandler(logging.Handler):
+    """
+    Handler which passes log records, received from worker processes,
+    to :py:const:`LOGGER`.
+    """
+
+    def emit(self, record):
+        LOGGER.handle(record)
+
+
+def _init_worker(log_queue, level, counts):
+    """
+    Initialise a worker process. If ``log_queue`` is provided, then
+    :py:const:`LOGGER` is configured to put log records onto
+    ``log_queue`` rather than writing them itself.
+    :py:const:`_COUNT_CACHE` is set to ``counts``, the read counts
+    cached by the parent process.
+
+    :param log_queue: Queue or ``None``
+    :type log_queue: multiprocessing.Queue
+    :param level: Logging level
+    :type level: int
+    :param counts: Read counts cached by the parent process
+    :type counts: dict
+    """
+    if log_queue is not None:
+        LOGGER.handlers = [logging.handlers.QueueHandler(log_queue)]
+        LOGGER.setLevel(level)
+        LOGGER.propagate = False
+    _COUNT_CACHE.clear()
+    _COUNT_CACHE.update(counts)
+
+
+def _call_counting(function, *args):
+    """
+    Call a function, in a worker process, and return its result
+    along with any read counts it added to :py:const:`_COUNT_CACHE`,
+    so these can be merged into the parent process's cache.
+
+    This must only be called in a worker process, which runs one task
+    at a time, as the counts are recorded in
+    :py:const:`_TASK_COUNTS`.
+
+    :param function: Function
+    :type function: function
+    :param args: Arguments for ``function``
+    :type args: list
+    :return: result of ``function`` and new or updated cache entries
+    :rtype: tuple(object, dict)
+    """
+    global _TASK_COUNTS
+    _TASK_COUNTS = {}
+    try:
+        return function(*args), _TASK_COUNTS
+    finally:
+        _TASK_COUNTS = None
+
+
+def _submit_counting(pool, function, *args):
+    """
+    Submit a function, which counts reads, to ``pool``. If ``pool``
+    is a process pool then, when the function completes, the read
+    counts it cached are merged into :py:const:`_COUNT_CACHE`. Other
+    executors run the function in this process, so it updates
+    :py:const:`_COUNT_CACHE` itself.
+
+    :param pool: executor that the function will be submitted to
+    :type pool: concurrent.futures.Executor
+    :param function: Function
+    :type function: function
+    :param args: Arguments for ``function``
+    :type args: list
+    :return: future whose result is the result of ``function``
+    :rtype: concurrent.futures.Future
+    """
+    if not isinstance(pool, concurrent.futures.ProcessPoolExecutor):
+        return pool.submit(function, *args)
+    future = concurrent.futures.Future()
+
+    def merge_counts(counting_future):
+        try:
+            result, counts = counting_future.result()
+        except Exception as e:
+            future.set_exception(e)
+            return
+        _COUNT_CACHE.update(counts)
+        future.set_result(result)
+
+    pool.submit(_call_counting, function, *args).add_done_callback(
+        merge_counts)
+    return future
+
+
+def _count_cached(file_name, count_sequences=fastq.count_sequences):
+    """
+    Count number of reads in a file, reusing a previous count if the
+    file has not changed since it was last counted. A file is assumed
+    to be unchanged if its modification time and size are the same.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param count_sequences: Function to count reads in ``file_name``
+    :type count_sequences: function
+    :return: result of ``count_sequences``
+    :rtype: int or tuple(int, int)
+    :raise Exception: If problems arise when counting reads
+    """
+    stat = os.stat(file_name)
+    key = (count_sequences, os.path.abspath(file_name))
+    cached = _COUNT_CACHE.get(key)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns,
+                                             stat.st_size):
+        return cached[2]
+    count = count_sequences(file_name)
+    _COUNT_CACHE[key] = (stat.st_mtime_ns, stat.st_size, count)
+    if _TASK_COUNTS is not None:
+        _TASK_COUNTS[key] = _COUNT_CACHE[key]
+    return count
+
+
+def _read_tsv(file_name, comment="#"):
+    """
+    Read a small TSV file with a header row, skipping lines that
+    start with ``comment``.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :param comment: Comment prefix
+    :type comment: str or unicode
+    :return: rows, each a mapping from column names to values
+    :rtype: list(dict)
+    """
+    with open(file_name, "r", newline="") as f:
+        lines = (line for line in f if not line.startswith(comment))
+        return list(csv.DictReader(lines, delimiter="\t"))
+
+
+def _count_sam_fast(file_name):
+    """
+    Count number of sequences in a SAM or BAM file.
+
+    BAM files are counted using ``samtools view -c``, if ``samtools``
+    is available, or :py:func:`riboviz.sam_bam.count_sequences`
+    otherwise. SAM files are counted by counting the lines that
+    follow the header.
+
+    The return value is compatible with that of
+    :py:func:`riboviz.sam_bam.count_sequences` but the number of
+    mapped sequences is not counted.
+
+    :param file_name: SAM/BAM file name
+    :type file_name: str or unicode
+    :return: (number of sequences, ``None``)
+    :rtype: tuple(int, NoneType)
+    :raise subprocess.CalledProcessError: If ``samtools`` fails
+    """
+    if sam_bam.is_bam(file_name):
+        if shutil.which(SAMTOOLS) is None:
+            num_sequences, _ = sam_bam.count_sequences(file_name)
+            return (num_sequences, None)
+        output = subprocess.check_output(
+            [SAMTOOLS, "view", "-c", "-@", str(SAMTOOLS_THREADS),
+             "--", file_name])
+        return (int(output), None)
+    with open(file_name, "rb") as f:
+        line = f.readline()
+        while line.startswith(b"@"):
+            line = f.readline()
+        if not line:
+            return (0, None)
+        return (1 + fastq.count_lines(f), None)
+
+
+def _scan_sample_dir(tmp_dir, sample=""):
+    """
+    Scan ``<tmp_dir>/<sample>`` once and group the files within it by
+    which of :py:const:`_SAMPLE_FILE_SUFFIXES` their names end with,
+    or which of :py:const:`_SAMPLE_FILE_NAMES` their names are.
+    A file can be in more than one group (for example
+    :py:const:`riboviz.workflow_files.UMI_EXTRACT_FQ` file names
+    also end with
+    :py:const:`riboviz.workflow_files.ADAPTER_TRIM_FQ`). If the
+    directory does not exist then all the groups are empty.
+
+    :param tmp_dir: Directory
+    :type tmp_dir: str or unicode
+    :param sample: Sample name
+    :type sample: str or unicode
+    :return: map from suffixes and names to sorted lists of paths \
+    of files with those suffixes or names
+    :rtype: dict(str or unicode => list(str or unicode))
+    """
+    sample_files = {name: [] for name in
+                    _SAMPLE_FILE_SUFFIXES + _SAMPLE_FILE_NAMES}
+    try:
+        entries = os.scandir(os.path.join(tmp_dir, sample))
+    except (FileNotFoundError, NotADirectoryError):
+        return sample_files
+    with entries:
+        for entry in entries:
+            for suffix in _SAMPLE_FILE_SUFFIXES:
+                if entry.name.endswith(suffix):
+                    sample_files[suffix].append(entry.path)
+            if entry.name in _SAMPLE_FILE_NAMES:
+                sample_files[entry.name].append(entry.path)
+    for files in sample_files.values():
+        files.sort()
+    return sample_files
+
+
+def config_samples(config, input_dir):
+    """
+    Extract names of samples from workflow configuration.
 
+    The sample names are the keys of the ``fq_files`` value, if
+    any. If there is a ``multiplex_fq_files`` value then the
+    ``SampleID`` values in the ``sample_sheet`` file (relative to
+    ``input_dir``) are also sample names.
 
-def input_fq(config_file, input_dir, pool=None):
+    If no sample names can be found, or the sample sheet cannot be
+    read, then ``None`` is returned.
+
+    :param config: Workflow configuration
+    :type config: dict
+    :param input_dir: Directory
+    :type input_dir: str or unicode
+    :return: sorted sample names, or ``None``
+    :rtype: list(str or unicode)
+    """
+    samples = set()
+    if config.get(params.FQ_FILES):
+        samples.update(config[params.FQ_FILES].keys())
+    if config.get(params.MULTIPLEX_FQ_FILES):
+        if not config.get(params.SAMPLE_SHEET):
+            return None
+        sample_sheet_file = os.path.join(input_dir,
+                                         config[params.SAMPLE_SHEET])
+        try:
+            samples.update(row[sample_sheets.SAMPLE_ID]
+                           for row in _read_tsv(sample_sheet_file))
+        except Exception as e:
+            LOGGER.warning(e)
+            return None
+    if not samples:
+        return None
+    return sorted(samples)
+
+
+def input_fq(config, input_dir, pool=None):
     """
     Extract names of FASTQ input files from workflow configuration
-    file and count the number of reads in each file.
+    and count the number of reads in each file.
 
-    The configuration file is checked to see if it has an ``fq_files``
+    The configuration is checked to see if it has an ``fq_files``
     key whose value is mappings from sample names to sample files
     (relative to ``input_dir``). Each FASTQ file has its reads
     counted.
@@ -96,37 +388,31 @@ def input_fq(config_file, input_dir, pool=None):
 
     If neither key exists then no input files are traversed.
 
-    For each file a ``pandas.core.frame.Series`` is created with
-    fields ``SampleName`` (sample name recorded in configuration or,
-    for multiplexed files, ``''``), ``Program`` (set to ``input``),
-    ``File``, ``NumReads``, ``Description`` (``input``).
+    For each file a tuple is created with fields ``SampleName``
+    (sample name recorded in configuration or, for multiplexed files,
+    ``''``), ``Program`` (set to ``input``), ``File``, ``NumReads``,
+    ``Description`` (``input``).
 
     Parameter ``pool`` is used for multiprocessing:
 
     * If it is not specified, then the code will run in one process,
-      and return a list of Pandas dataframes,
-      (``pandas.core.frame.Series``).
+      and return a list of tuples.
     * If it is specified, the code will use the workers of the pool to
       run different samples in parallel, and return a list of
-      ``multiprocessing.pool.ApplyResult``, where the Pandas
-      dataframes can be obtained by the ``.get()`` function on these
-      objects.
+      ``concurrent.futures.Future``, where the tuples can be
+      obtained by the ``.result()`` function on these objects.
 
-    :param config_file: Configuration file
-    :type config_file: str or unicode
+    :param config: Workflow configuration
+    :type config: dict
     :param input_dir: Directory
     :type input_dir: str or unicode
-    :param pool: multiprocessing pool object that the process will be \
-    joined into
-    :type pool: multiprocessing.Pool
-    :return: list of ``pandas.core.frame.Series`` or ``[]`` if \
-    ``pool`` is not specified. If ``pool`` is specified, then the return \
-    list will be a list of ``multiprocessing.pool.ApplyResult``.
-    :rtype: list(pandas.core.frame.Series) OR\
-    list(multiprocessing.pool.ApplyResult).
+    :param pool: executor that the counting tasks will be submitted to
+    :type pool: concurrent.futures.Executor
+    :return: list of tuples or ``[]`` if ``pool`` is not \
+    specified. If ``pool`` is specified, then the return list will be \
+    a list of ``concurrent.futures.Future``.
+    :rtype: list(tuple) OR list(concurrent.futures.Future).
     """
-    with open(config_file, 'r') as f:
-        config = yaml.load(f, yaml.SafeLoader)
     rows = []
     if params.FQ_FILES in config and config[params.FQ_FILES] is not None:
         sample_files = [(sample_name, os.path.join(input_dir, file_name))
@@ -142,17 +428,16 @@ def input_fq(config_file, input_dir, pool=None):
         multiplex_files = []
     files = sample_files + multiplex_files
     for (sample_name, file_name) in files:
-        print(file_name)
         try:
             if pool is None:
                 # Serial version.
                 rows.append(_input_fq_count(sample_name, file_name))
             else:
                 # Use the worker of pool to execute in parallel.
-                rows.append(pool.apply_async(_input_fq_count,
-                                             args=(sample_name, file_name,)))
+                rows.append(_submit_counting(pool, _input_fq_count,
+                                             sample_name, file_name))
         except Exception as e:
-            print(e)
+            LOGGER.warning(e)
             continue
     return rows
 
@@ -169,67 +454,62 @@ def _input_fq_count(sample_name, file_name):
     :type sample_name: str or unicode
     :param file_name: path to file
     :type file_name: str or unicode
-    :return: ``pandas.core.frame.Series``, or ``None``
-    :rtype: pandas.core.frame.Series
+    :return: row, or ``None``
+    :rtype: tuple
     """
+    LOGGER.info(file_name)
     try:
-        num_reads = fastq.count_sequences(file_name)
-        return pd.DataFrame(
-            [[sample_name, INPUT, file_name, num_reads, INPUT]],
-            columns=HEADER)
+        num_reads = _count_cached(file_name)
+        return (sample_name, INPUT, file_name, num_reads, INPUT)
     except Exception as e:
-        print(e)
+        LOGGER.warning(e)
         # Return None so that this sample/file combination will be
         # treated as invalid in later processing.
         return None
 
 
-def cutadapt_fq(tmp_dir, sample=""):
+def cutadapt_fq(sample_files, sample=""):
     """
     Count number of reads in the FASTQ file output by ``cutadapt``.
 
-    ``<tmp_dir>/<sample>`` is searched for a FASTQ file matching
+    ``sample_files`` is searched for a FASTQ file matching
     :py:const:`riboviz.workflow_files.ADAPTER_TRIM_FQ`. Any file
     also matching :py:const:`riboviz.workflow_files.UMI_EXTRACT_FQ`
     is then removed (these file names overlap). The number of reads in
     the resulting file are counted.
 
-    A ``pandas.core.frame.Series`` is created with fields
-    ``SampleName``, ``Program``, ``File``, ``NumReads``,
-    ``Description``.
+    A tuple is created with fields ``SampleName``, ``Program``,
+    ``File``, ``NumReads``, ``Description``.
 
-    :param tmp_dir: Directory
-    :type tmp_dir: str or unicode
+    :param sample_files: Files in ``<tmp_dir>/<sample>``, from \
+    :py:func:`_scan_sample_dir`
+    :type sample_files: dict(str or unicode => list(str or unicode))
     :param sample: Sample name
     :type sample: str or unicode
-    :return: ``pandas.core.frame.Series``, or ``None``
-    :rtype: pandas.core.frame.Series
+    :return: row, or ``None``
+    :rtype: tuple
     """
-    fq_files = glob.glob(os.path.join(
-        tmp_dir, sample, "*" + workflow_files.ADAPTER_TRIM_FQ))
+    fq_files = sample_files[workflow_files.ADAPTER_TRIM_FQ]
     # If using with FASTQ files then there may be a
-    # file with extension "_extract_trim.fq" which also will be
-    # caught by the glob above, so remove this file name.
-    umi_files = glob.glob(os.path.join(
-        tmp_dir, sample, "*" + workflow_files.UMI_EXTRACT_FQ))
+    # file with extension "_extract_trim.fq" which also will
+    # match the suffix above, so remove this file name.
+    umi_files = set(sample_files[workflow_files.UMI_EXTRACT_FQ])
     fq_files = [file_name for file_name in fq_files
                 if file_name not in umi_files]
     if not fq_files:
         return None
     fq_file = fq_files[0]  # Only 1 match expected.
-    print(fq_file)
+    LOGGER.info(fq_file)
     try:
-        num_reads = fastq.count_sequences(fq_file)
+        num_reads = _count_cached(fq_file)
     except Exception as e:
-        print(e)
+        LOGGER.warning(e)
         return None
     description = "Reads after removal of sequencing library adapters"
-    row = pd.DataFrame([[sample, "cutadapt", fq_file, num_reads,
-                         description]], columns=HEADER)
-    return row
+    return (sample, "cutadapt", fq_file, num_reads, description)
 
 
-def umi_tools_deplex_fq(tmp_dir):
+def umi_tools_deplex_fq(tmp_dir, pool=None):
     """
     Count number of reads in the FASTQ files output by
     :py:mod:`riboviz.tools.demultiplex_fastq`.
@@ -246,153 +526,188 @@ def umi_tools_deplex_fq(tmp_dir):
     cannot be found then the number of reads in the FASTQ files
     themselves are counted.
 
-    For each file a ``pandas.core.frame.Series`` is created with
-    fields ``SampleName``, ``Program``, ``File``, ``NumReads``,
-    ``Description``.
+    For each file a tuple is created with fields ``SampleName``,
+    ``Program``, ``File``, ``NumReads``, ``Description``.
+
+    Parameter ``pool`` is used for multiprocessing:
+
+    * If it is not specified, then the FASTQ files are counted in
+      this process, and a list of tuples is returned.
+    * If it is specified, the code will use the workers of the pool to
+      count the FASTQ files in parallel, and the returned list will
+      contain a ``concurrent.futures.Future`` in place of the tuple
+      for each of these files. The tuples can be obtained by the
+      ``.result()`` function on these objects (the result is ``None``
+      if the file could not be counted).
 
     :param tmp_dir: Directory
     :type tmp_dir: str or unicode
-    :return: list of ``pandas.core.frame.Series``, or ``[]``
-    :rtype: list(pandas.core.frame.Series)
+    :param pool: executor that the counting tasks will be submitted to
+    :type pool: concurrent.futures.Executor
+    :return: list of tuples, or ``[]``. If ``pool`` is specified, then \
+    the list may also contain ``concurrent.futures.Future``.
+    :rtype: list(tuple) OR list(tuple or concurrent.futures.Future)
     """
-    deplex_dirs = glob.glob(os.path.join(
-        tmp_dir, workflow_files.DEPLEX_DIR_FORMAT.format("*")))
+    deplex_suffix = workflow_files.DEPLEX_DIR_FORMAT.format("")
+    with os.scandir(tmp_dir) as entries:
+        deplex_dirs = [entry.path for entry in entries
+                       if entry.name.endswith(deplex_suffix)
+                       and entry.is_dir()]
     if not deplex_dirs:
         return []
     description = "Demultiplexed reads"
     rows = []
     for deplex_dir in deplex_dirs:
-        fq_files = [glob.glob(os.path.join(deplex_dir, "*" + ext))
-                    for ext in fastq.FASTQ_EXTS]
-        # Flatten
-        fq_files = [f for files in fq_files for f in files]
+        with os.scandir(deplex_dir) as entries:
+            deplex_files = {entry.name: entry.path for entry in entries}
+        # Pair each FASTQ file with its tag, taken from the file name.
+        fq_files = [(path, name.split(".")[0])
+                    for name, path in deplex_files.items()
+                    if name.endswith(tuple(fastq.FASTQ_EXTS))]
         if not fq_files:
             continue
         fq_files.sort()
-        tsv_files = glob.glob(
-            os.path.join(deplex_dir,
-                         demultiplex_fastq.NUM_READS_FILE))
+        tsv_files = [path for name, path in deplex_files.items()
+                     if name == demultiplex_fastq.NUM_READS_FILE]
         is_tsv_problem = False
         if tsv_files:
             num_reads_file = tsv_files[0]
-            print(num_reads_file)
+            LOGGER.info(num_reads_file)
             try:
-                deplex_df = pd.read_csv(num_reads_file,
-                                        delimiter="\t",
-                                        comment="#")
-                for fq_file in fq_files:
-                    tag = os.path.basename(fq_file).split(".")[0]
-                    tag_df = deplex_df[
-                        deplex_df[sample_sheets.SAMPLE_ID] == tag]
-                    num_reads = tag_df.iloc[0][sample_sheets.NUM_READS]
-                    row = pd.DataFrame(
-                        [[tag,
-                          demultiplex_fastq_tools_module.__name__,
-                          fq_file, num_reads, description]],
-                        columns=HEADER)
-                    rows.append(row)
+                tag_num_reads = {
+                    row[sample_sheets.SAMPLE_ID]:
+                    int(row[sample_sheets.NUM_READS])
+                    for row in _read_tsv(num_reads_file)}
+                # Look up all the files before adding any rows, so that
+                # if a tag is missing from the TSV file no rows are
+                # duplicated when the FASTQ files are traversed.
+                tsv_rows = []
+                for fq_file, tag in fq_files:
+                    tsv_rows.append((tag,
+                                     demultiplex_fastq_tools_module.__name__,
+                                     fq_file, tag_num_reads[tag],
+                                     description))
+                rows.extend(tsv_rows)
             except Exception as e:
-                print(e)
+                LOGGER.warning(e)
                 is_tsv_problem = True
         if is_tsv_problem or not tsv_files:
             # Traverse FASTQ files directly.
-            for fq_file in fq_files:
-                print(fq_file)
-                tag = os.path.basename(fq_file).split(".")[0]
-                try:
-                    num_reads = fastq.count_sequences(fq_file)
-                except Exception as e:
-                    print(e)
-                    continue
-                row = pd.DataFrame(
-                    [[tag,
-                      demultiplex_fastq_tools_module.__name__,
-                      fq_file, num_reads, description]],
-                    columns=HEADER)
-                rows.append(row)
+            for fq_file, tag in fq_files:
+                if pool is None:
+                    # Serial version.
+                    row = _deplex_fq_count(tag, fq_file, description)
+                    if row is not None:
+                        rows.append(row)
+                else:
+                    # Use the worker of pool to execute in parallel.
+                    rows.append(_submit_counting(pool, _deplex_fq_count,
+                                                 tag, fq_file, description))
     return rows
 
 
-def hisat2_fq(tmp_dir, sample, fq_file_name, description):
+def _deplex_fq_count(tag, fq_file, description):
+    """
+    Count number of reads in a FASTQ file output by
+    :py:mod:`riboviz.tools.demultiplex_fastq`.
+
+    :param tag: Sample name, from the FASTQ file name
+    :type tag: str or unicode
+    :param fq_file: path to file
+    :type fq_file: str or unicode
+    :param description: Description of this step
+    :type description: str or unicode
+    :return: row, or ``None``
+    :rtype: tuple
+    """
+    LOGGER.info(fq_file)
+    try:
+        num_reads = _count_cached(fq_file)
+    except Exception as e:
+        LOGGER.warning(e)
+        return None
+    return (tag, demultiplex_fastq_tools_module.__name__, fq_file,
+            num_reads, description)
+
+
+def hisat2_fq(sample_files, sample, fq_file_name, description):
     """
     Count number of reads in the FASTQ file output by ``hisat2``.
 
-    ``<tmp_dir>/<sample>`` is searched for a FASTQ file matching
+    ``sample_files`` is searched for a FASTQ file matching
     ``fq_file_name``. The number of reads in the file are counted.
 
-    A ``pandas.core.frame.Series`` is created with fields
-    ``SampleName``, ``Program``, ``File``, ``NumReads``,
-    ``Description``.
+    A tuple is created with fields ``SampleName``, ``Program``,
+    ``File``, ``NumReads``, ``Description``.
 
-    :param tmp_dir: Directory
-    :type tmp_dir: str or unicode
+    :param sample_files: Files in ``<tmp_dir>/<sample>``, from \
+    :py:func:`_scan_sample_dir`
+    :type sample_files: dict(str or unicode => list(str or unicode))
     :param sample: Sample name
     :type sample: str or unicode
-    :param fq_file_name: FASTQ file name pattern
+    :param fq_file_name: FASTQ file name, one of \
+    :py:const:`_SAMPLE_FILE_NAMES`
     :type fq_file_name: str or unicode
     :param description: Description of this step
     :type description: str or unicode
-    :return: ``pandas.core.frame.Series``, or ``None``
-    :rtype: pandas.core.frame.Series
+    :return: row, or ``None``
+    :rtype: tuple
     """
-    fq_files = glob.glob(os.path.join(tmp_dir, sample, fq_file_name))
+    fq_files = sample_files[fq_file_name]
     if not fq_files:
         return None
     fq_file = fq_files[0]  # Only 1 match expected
-    print(fq_file)
+    LOGGER.info(fq_file)
     try:
-        num_reads = fastq.count_sequences(fq_file)
+        num_reads = _count_cached(fq_file)
     except Exception as e:
-        print(e)
+        LOGGER.warning(e)
         return None
-    row = pd.DataFrame([[sample, "hisat2", fq_file, num_reads,
-                         description]], columns=HEADER)
-    return row
+    return (sample, "hisat2", fq_file, num_reads, description)
 
 
-def hisat2_sam(tmp_dir, sample, sam_file_name, description):
+def hisat2_sam(sample_files, sample, sam_file_name, description):
     """
     Count number of reads in the SAM file output by ``hisat2``.
 
-    ``<tmp_dir>/<sample>`` is searched for a SAM file matching
+    ``sample_files`` is searched for a SAM file matching
     ``sam_file_name``. The number of reads in the file are counted.
 
-    A ``pandas.core.frame.Series`` is created with fields
-    ``SampleName``, ``Program``, ``File``, ``NumReads``,
-    ``Description``.
+    A tuple is created with fields ``SampleName``, ``Program``,
+    ``File``, ``NumReads``, ``Description``.
 
-    :param tmp_dir: Directory
-    :type tmp_dir: str or unicode
+    :param sample_files: Files in ``<tmp_dir>/<sample>``, from \
+    :py:func:`_scan_sample_dir`
+    :type sample_files: dict(str or unicode => list(str or unicode))
     :param sample: Sample name
     :type sample: str or unicode
-    :param sam_file_name: SAM file name pattern
+    :param sam_file_name: SAM file name, one of \
+    :py:const:`_SAMPLE_FILE_NAMES`
     :type sam_file_name: str or unicode
     :param description: Description of this step
     :type description: str or unicode
-    :return: ``pandas.core.frame.Series``, or ``None``
-    :rtype: pandas.core.frame.Series
+    :return: row, or ``None``
+    :rtype: tuple
     """
-    sam_files = glob.glob(os.path.join(tmp_dir, sample, sam_file_name))
+    sam_files = sample_files[sam_file_name]
     if not sam_files:
         return None
     sam_file = sam_files[0]  # Only 1 match expected.
-    print(sam_file)
+    LOGGER.info(sam_file)
     try:
-        sequences, _ = sam_bam.count_sequences(sam_file)
+        sequences, _ = _count_cached(sam_file, _count_sam_fast)
     except Exception as e:
-        print(e)
+        LOGGER.warning(e)
         return None
-    row = pd.DataFrame([[sample, "hisat2", sam_file, sequences,
-                         description]], columns=HEADER)
-    return row
+    return (sample, "hisat2", sam_file, sequences, description)
 
 
-def trim_5p_mismatch_sam(tmp_dir, sample):
+def trim_5p_mismatch_sam(sample_files, sample):
     """
     Count number of reads in the SAM file output by
     :py:mod:`riboviz.tools.trim_5p_mismatch`.
 
-    ``<tmp_dir>/<sample>`` is searched for a SAM file matching
+    ``sample_files`` is searched for a SAM file matching
     :py:const:`riboviz.workflow_files.ORF_MAP_CLEAN_SAM` and
     a TSV file matching
     :py:const:`riboviz.workflow_files.TRIM_5P_MISMATCH_TSV`.
@@ -401,102 +716,91 @@ def trim_5p_mismatch_sam(tmp_dir, sample):
     extracted. If the TSV file cannot be found then the number of
     reads in the SAM file itself are counted.
 
-    A ``pandas.core.frame.Series`` is created with fields
-    ``SampleName``, ``Program``, ``File``, ``NumReads``,
-    ``Description``.
+    A tuple is created with fields ``SampleName``, ``Program``,
+    ``File``, ``NumReads``, ``Description``.
 
-    :param tmp_dir: Directory
-    :type tmp_dir: str or unicode
+    :param sample_files: Files in ``<tmp_dir>/<sample>``, from \
+    :py:func:`_scan_sample_dir`
+    :type sample_files: dict(str or unicode => list(str or unicode))
     :param sample: Sample name
     :type sample: str or unicode
-    :return: ``pandas.core.frame.Series``, or ``None``
-    :rtype: pandas.core.frame.Series
+    :return: row, or ``None``
+    :rtype: tuple
     """
     # Look for the SAM file.
-    sam_files = glob.glob(os.path.join(
-        tmp_dir, sample, workflow_files.ORF_MAP_CLEAN_SAM))
+    sam_files = sample_files[workflow_files.ORF_MAP_CLEAN_SAM]
     if not sam_files:
         return None
     sam_file = sam_files[0]  # Only 1 match expected.
     # Look for trim_5p_mismatch.tsv.
-    tsv_files = glob.glob(os.path.join(
-        tmp_dir, sample, workflow_files.TRIM_5P_MISMATCH_TSV))
+    tsv_files = sample_files[workflow_files.TRIM_5P_MISMATCH_TSV]
     is_tsv_problem = False
     if tsv_files:
         tsv_file = tsv_files[0]
-        print(tsv_file)
+        LOGGER.info(tsv_file)
         try:
-            trim_data = pd.read_csv(tsv_file, delimiter="\t", comment="#")
-            trim_row = trim_data.iloc[0]
-            sequences = trim_row[trim_5p_mismatch.NUM_WRITTEN]
+            trim_row = _read_tsv(tsv_file)[0]
+            sequences = int(trim_row[trim_5p_mismatch.NUM_WRITTEN])
         except Exception as e:
-            print(e)
+            LOGGER.warning(e)
             is_tsv_problem = True
     if is_tsv_problem or not tsv_files:
         # Traverse SAM file directly.
-        print(sam_file)
+        LOGGER.info(sam_file)
         try:
-            sequences, _ = sam_bam.count_sequences(sam_file)
+            sequences, _ = _count_cached(sam_file, _count_sam_fast)
         except Exception as e:
-            print(e)
+            LOGGER.warning(e)
             return None
     description = "Reads after trimming of 5' mismatches and removal of those with more than 2 mismatches"
-    row = pd.DataFrame([[sample,
-                         trim_5p_mismatch_tools_module.__name__,
-                         sam_file, sequences, description]],
-                       columns=HEADER)
-    return row
+    return (sample, trim_5p_mismatch_tools_module.__name__, sam_file,
+            sequences, description)
 
 
-def umi_tools_dedup_bam(tmp_dir, output_dir, sample):
+def umi_tools_dedup_bam(sample_files, output_dir, sample):
     """
     Count number of reads in the BAM file output by
     ``umi_tools dedup``.
 
-    ``<tmp_dir>/<sample>`` is searched for a BAM file matching
+    ``sample_files`` is searched for a BAM file matching
     :py:const:`riboviz.workflow_files.DEDUP_BAM` and
     if this is found the reads in the output file
     ``<output_dir>/<sample>/<sample>.bam`` are counted.
 
-    A ``pandas.core.frame.Series`` is created with fields
-    ``SampleName``, ``Program``, ``File``, ``NumReads``,
-    ``Description``.
+    A tuple is created with fields ``SampleName``, ``Program``,
+    ``File``, ``NumReads``, ``Description``.
 
-    :param tmp_dir: Temporary directory
-    :type tmp_dir: str or unicode
+    :param sample_files: Files in ``<tmp_dir>/<sample>``, from \
+    :py:func:`_scan_sample_dir`
+    :type sample_files: dict(str or unicode => list(str or unicode))
     :param output_dir: Output directory
     :type output_dir: str or unicode
     :param sample: Sample name
     :type sample: str or unicode
-    :return: ``pandas.core.frame.Series``, or ``None``
-    :rtype: pandas.core.frame.Series
+    :return: row, or ``None``
+    :rtype: tuple
     """
     # Look for dedup.bam.
-    files = glob.glob(
-        os.path.join(tmp_dir, sample, workflow_files.DEDUP_BAM))
-    if not files:
+    if not sample_files[workflow_files.DEDUP_BAM]:
         # Deduplication was not done.
         return None
     # Look for the BAM file output.
-    files = glob.glob(os.path.join(
-        output_dir, sample, sam_bam.BAM_FORMAT.format(sample)))
-    if not files:
+    file_name = os.path.join(
+        output_dir, sample, sam_bam.BAM_FORMAT.format(sample))
+    if not os.path.isfile(file_name):
         return None
-    file_name = files[0]
-    print(file_name)
+    LOGGER.info(file_name)
     try:
-        sequences, _ = sam_bam.count_sequences(file_name)
+        sequences, _ = _count_cached(file_name, _count_sam_fast)
     except Exception as e:
-        print(e)
+        LOGGER.warning(e)
         return None
     description = "Deduplicated reads"
-    row = pd.DataFrame(
-        [[sample, "umi_tools dedup", file_name, sequences, description]],
-        columns=HEADER)
-    return row
+    return (sample, "umi_tools dedup", file_name, sequences, description)
 
 
-def count_reads_df(config_file, input_dir, tmp_dir, output_dir):
+def count_reads_df(config_file, input_dir, tmp_dir, output_dir,
+                   log_queue=None):
     """
     Scan input, temporary and output directories and count the number
     of reads (sequences) processed by specific stages of a
@@ -515,65 +819,82 @@ def count_reads_df(config_file, input_dir, tmp_dir, output_dir):
     :type tmp_dir: str or unicode
     :param output_dir: Output files directory
     :type output_dir: str or unicode
+    :param log_queue: Queue onto which worker processes put their \
+    log records. If not provided, worker processes log directly.
+    :type log_queue: multiprocessing.Queue
     :return: ``pandas.core.frame.DataFrame``
     :rtype: pandas.core.frame.DataFrame
     """
-    df = pd.DataFrame(columns=HEADER)
-    # Create a multiprocessing pool.
-    # We do not specify the worker number because this is the last
-    # process of the workflow, so it can use all cores.
-    pool = multiprocessing.Pool()
-    result_ret = []
-    # The item of result_ret is of form [type,content], where type
-    # represents how the result should be processed.
-    result_ret.append(['MULTIPLE',
-                       input_fq(config_file, input_dir, pool)])
-    result_ret.append(['APPEND',
-                       pool.apply_async(cutadapt_fq, args=(tmp_dir,))])
-    result_ret.append(['EXTEND',
-                       pool.apply_async(umi_tools_deplex_fq, args=(tmp_dir,))])
-    tmp_samples = [f.name for f in os.scandir(tmp_dir) if f.is_dir()]
-    tmp_samples.sort()
-    for sample in tmp_samples:
-        result_ret.append(['APPEND',
-                           pool.apply_async(cutadapt_fq,
-                                            args=(tmp_dir, sample,))])
-        result_ret.append(['APPEND',
-                           pool.apply_async(hisat2_fq,
-                                            args=(tmp_dir, sample, workflow_files.NON_RRNA_FQ,
-                                                  "Reads that did not align to rRNA or other contaminating reads in rRNA index files",))])
-        result_ret.append(['APPEND',
-                           pool.apply_async(hisat2_sam,
-                                            args=(tmp_dir, sample, workflow_files.RRNA_MAP_SAM,
-                                                  "Reads aligned to rRNA and other contaminating reads in rRNA index files",))])
-        result_ret.append(['APPEND',
-                           pool.apply_async(hisat2_fq,
-                                            args=(tmp_dir, sample, workflow_files.UNALIGNED_FQ,
-                                                  "Unaligned reads removed by alignment of remaining reads to ORFs index files",))])
-        result_ret.append(['APPEND',
-                           pool.apply_async(hisat2_sam,
-                                            args=(tmp_dir, sample, workflow_files.ORF_MAP_SAM,
-                                                  "Reads aligned to ORFs index files",))])
-        result_ret.append(['APPEND',
-                           pool.apply_async(trim_5p_mismatch_sam,
-                                            args=(tmp_dir, sample,))])
-        result_ret.append(['APPEND',
-                           pool.apply_async(umi_tools_dedup_bam,
-                                            args=(tmp_dir, output_dir, sample,))])
-        rows = []
-    pool.close()
-    pool.join()
-    for i in result_ret:
-        if i[0] == 'MULTIPLE':
-            for j in i[1]:
-                rows.append(j.get())
-        elif i[0] == 'EXTEND':
-            rows.extend(i[1].get())
-        else:
-            rows.append(i[1].get())
-    rows = [row for row in rows if row is not None]
-    df = df.append(rows)
-    return df
+    with open(config_file, 'r') as f:
+        config = yaml.load(f, _SafeLoader)
+    # Reads are counted in a process pool. We do not specify the
+    # worker number because this is the last process of the
+    # workflow, so it can use all cores. Tasks which only parse
+    # small summary files are run in a thread pool, to avoid the
+    # overhead of dispatching them to another process. Workers start
+    # with, and their results update, the read counts cached by this
+    # process.
+    # The thread pool is exited, and so shut down, first, as its
+    # tasks may still be submitting tasks to the process pool.
+    with concurrent.futures.ProcessPoolExecutor(
+            initializer=_init_worker,
+            initargs=(log_queue, LOGGER.getEffectiveLevel(),
+                      dict(_COUNT_CACHE))) as process_pool, \
+            concurrent.futures.ThreadPoolExecutor() as thread_pool:
+        # Futures, in submission order. Each future's result is a row,
+        # None, or, for umi_tools_deplex_fq, a list of rows and futures.
+        futures = input_fq(config, input_dir, process_pool)
+        futures.append(_submit_counting(process_pool, cutadapt_fq,
+                                        _scan_sample_dir(tmp_dir)))
+        futures.append(thread_pool.submit(umi_tools_deplex_fq, tmp_dir,
+                                          process_pool))
+        # Use the samples named in the configuration, to avoid scanning
+        # tmp_dir, falling back to the sample directories in tmp_dir.
+        tmp_samples = config_samples(config, input_dir)
+        if tmp_samples is None:
+            tmp_samples = [f.name for f in os.scandir(tmp_dir) if f.is_dir()]
+            tmp_samples.sort()
+        for sample in tmp_samples:
+            sample_files = _scan_sample_dir(tmp_dir, sample)
+            futures.append(_submit_counting(process_pool, cutadapt_fq, sample_files, sample))
+            futures.append(_submit_counting(process_pool, hisat2_fq, sample_files, sample, workflow_files.NON_RRNA_FQ,
+                                            "Reads that did not align to rRNA or other contaminating reads in rRNA index files"))
+            futures.append(_submit_counting(process_pool, hisat2_sam, sample_files, sample, workflow_files.RRNA_MAP_SAM,
+                                            "Reads aligned to rRNA and other contaminating reads in rRNA index files"))
+            futures.append(_submit_counting(process_pool, hisat2_fq, sample_files, sample, workflow_files.UNALIGNED_FQ,
+                                            "Unaligned reads removed by alignment of remaining reads to ORFs index files"))
+            futures.append(_submit_counting(process_pool, hisat2_sam, sample_files, sample, workflow_files.ORF_MAP_SAM,
+                                            "Reads aligned to ORFs index files"))
+            # If trim_5p_mismatch.tsv exists then only it need be parsed.
+            if sample_files[workflow_files.TRIM_5P_MISMATCH_TSV]:
+                futures.append(thread_pool.submit(trim_5p_mismatch_sam, sample_files, sample))
+            else:
+                futures.append(_submit_counting(process_pool, trim_5p_mismatch_sam, sample_files, sample))
+            futures.append(_submit_counting(process_pool, umi_tools_dedup_bam, sample_files, output_dir, sample))
+        # Process results as tasks complete, including the futures
+        # returned within umi_tools_deplex_fq's results, keying each
+        # row by its submission position. The rows are sorted by these
+        # keys afterwards so the output is deterministic.
+        pending = {future: (index,) for index, future in enumerate(futures)}
+        keyed_rows = []
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                result = future.result()
+                if isinstance(result, list):
+                    for sub_index, row in enumerate(result):
+                        if isinstance(row, concurrent.futures.Future):
+                            pending[row] = key + (sub_index,)
+                        else:
+                            keyed_rows.append((key + (sub_index,), row))
+                else:
+                    keyed_rows.append((key, result))
+    keyed_rows.sort(key=lambda keyed_row: keyed_row[0])
+    rows = [row for _, row in keyed_rows]
+    return pd.DataFrame.from_records(
+        [row for row in rows if row is not None], columns=HEADER)
 
 
 def count_reads(config_file, input_dir, tmp_dir, output_dir, reads_file):
@@ -587,6 +908,10 @@ def count_reads(config_file, input_dir, tmp_dir, output_dir, reads_file):
     `reads_file`. The file header has column names ``SampleName``,
     ``Program``, ``File``, ``NumReads``, ``Description``.
 
+    Progress and error messages are logged via :py:const:`LOGGER`.
+    Messages from worker processes are put onto a queue and logged
+    by the calling process.
+
     :param config_file: Configuration file
     :type config_file: str or unicode
     :param input_dir: Input files directory
@@ -598,8 +923,14 @@ def count_reads(config_file, input_dir, tmp_dir, output_dir, reads_file):
     :param reads_file: Reads file output
     :type reads_file: str or unicode
     """
-    reads_df = count_reads_df(config_file, input_dir, tmp_dir,
-                              output_dir)
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, _LoggerHandler())
+    listener.start()
+    try:
+        reads_df = count_reads_df(config_file, input_dir, tmp_dir,
+                                  output_dir, log_queue)
+    finally:
+        listener.stop()
     provenance.write_provenance_header(__file__, reads_file)
     reads_df[list(reads_df.columns)].to_csv(
         reads_file, mode='a', sep="\t", index=False)
@@ -612,9 +943,10 @@ def equal_read_counts(file1, file2, comment="#"):
 
     The data frames are compared column-by-column. All columns, with
     the exception of ``File`` are compared for exact equality
-    using ``pandas.core.series.Series.equals``. ``File`` is
-    compared using the basename of the file only, ignoring
-    the path.
+    using ``numpy.array_equal``. ``File`` is compared using the
+    basename of the file only, ignoring the path. Empty values
+    (e.g. ``SampleName`` for multiplexed files) are read as empty
+    strings, so they compare as equal.
 
     :param file1: File name
     :type file1: str or unicode
@@ -625,8 +957,10 @@ def equal_read_counts(file1, file2, comment="#"):
     :raise AssertionError: If files differ in their contents
     :raise Exception: If problems arise when loading the files
     """
-    data1 = pd.read_csv(file1, sep="\t", comment=comment)
-    data2 = pd.read_csv(file2, sep="\t", comment=comment)
+    data1 = pd.read_csv(file1, sep="\t", comment=comment, engine="c",
+                        dtype={NUM_READS: "int64"}, keep_default_na=False)
+    data2 = pd.read_csv(file2, sep="\t", comment=comment, engine="c",
+                        dtype={NUM_READS: "int64"}, keep_default_na=False)
     try:
         assert data1.shape == data2.shape,\
             "Unequal shape: %s, %s"\
@@ -638,15 +972,14 @@ def equal_read_counts(file1, file2, comment="#"):
             "Unequal column names: %s, %s"\
             % (str(data1.columns), str(data2.columns))
         for column in [SAMPLE_NAME, PROGRAM, NUM_READS, DESCRIPTION]:
-            column1 = data1[column]
-            column2 = data2[column]
-            assert column1.equals(column2),\
+            column1 = data1[column].to_numpy()
+            column2 = data2[column].to_numpy()
+            assert np.array_equal(column1, column2),\
                 "Unequal column values: %s" % column
-        for (f1, f2) in zip(data1[FILE], data2[FILE]):
-            f1_name = os.path.basename(f1)
-            f2_name = os.path.basename(f2)
-            assert f1_name == f2_name, \
-                "Unequal column values: %s" % FILE
+        f1_names = np.array([os.path.basename(f) for f in data1[FILE]])
+        f2_names = np.array([os.path.basename(f) for f in data2[FILE]])
+        assert np.array_equal(f1_names, f2_names), \
+            "Unequal column values: %s" % FILE
     except AssertionError as error:
         # Add file names to error message.
         message = error.args[0]
@@ -2,9 +2,19 @@
 FASTQ-related constants and functions.
 """
 import gzip
+import mmap
+import os
 import os.path
+import shutil
+import subprocess
+import traceback
+import numpy as np
 from Bio import SeqIO
 from riboviz import utils
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
 
 FASTQ_EXT = "fastq"
 """ File extension. """
@@ -33,6 +43,14 @@ FASTQ_FORMATS = {FASTQ_EXT: FASTQ_FORMAT,
                  FASTQ_GZ_EXT: FASTQ_GZ_FORMAT,
                  FQ_GZ_EXT: FQ_GZ_FORMAT}
 """ Map from file extensions to file name formats. """
+LINES_PER_RECORD = 4
+""" Number of lines in each FASTQ record. """
+READ_BUFFER_SIZE = 1 << 20
+""" Size, in bytes, of chunks read when counting FASTQ records. """
+NEWLINE = ord("\n")
+""" Newline byte value. """
+PIGZ = "pigz"
+""" ``pigz`` command used to decompress GZIPped FASTQ files. """
 
 
 def is_fastq_gz(file_name):
@@ -64,25 +82,153 @@ def strip_fastq_gz(file_name):
     return file_name
 
 
+def open_fastq(file_name):
+    """
+    Open a FASTQ file for reading in binary mode. GZIPped FASTQ files
+    are opened using ``isal.igzip``, if ``python-isal`` is installed,
+    or ``gzip`` otherwise.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :return: file object
+    :rtype: io.BufferedIOBase
+    """
+    if is_fastq_gz(file_name):
+        if igzip is not None:
+            return igzip.open(file_name, "rb")
+        return gzip.open(file_name, "rb")
+    return open(file_name, "rb")
+
+
+def count_newlines(buffer):
+    """
+    Count number of newline bytes in a buffer. The buffer is viewed,
+    without copying, as a NumPy array whose comparison and
+    ``count_nonzero`` loops are SIMD-vectorised, which is several
+    times faster than ``bytes.count``.
+
+    :param buffer: Bytes-like object
+    :type buffer: bytes or bytearray or memoryview or numpy.ndarray
+    :return: number of newline bytes
+    :rtype: int
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    return int(np.count_nonzero(data == NEWLINE))
+
+
+def count_lines(f):
+    """
+    Count number of lines in a binary file object. A final line
+    without a trailing newline is counted.
+
+    Data is read into a single reusable buffer and counted using
+    :py:func:`count_newlines`.
+
+    :param f: File object opened in binary mode
+    :type f: io.BufferedIOBase
+    :return: number of lines
+    :rtype: int
+    """
+    num_lines = 0
+    last_byte = NEWLINE
+    buffer = bytearray(READ_BUFFER_SIZE)
+    with memoryview(buffer) as view:
+        num_read = f.readinto(buffer)
+        while num_read:
+            num_lines += count_newlines(view[:num_read])
+            last_byte = buffer[num_read - 1]
+            num_read = f.readinto(buffer)
+    if last_byte != NEWLINE:
+        num_lines += 1
+    return num_lines
+
+
+def count_lines_piped(file_name):
+    """
+    Count number of lines in a GZIPped file by reading the output of
+    ``pigz -dc``. Decompression runs in a separate process,
+    concurrently with the line counting.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :return: number of lines
+    :rtype: int
+    :raise FileNotFoundError: If ``pigz`` cannot be found
+    :raise subprocess.CalledProcessError: If ``pigz`` fails
+    """
+    cmd = [PIGZ, "-dc", "--", file_name]
+    with subprocess.Popen(cmd,
+                          stdout=subprocess.PIPE,
+                          bufsize=READ_BUFFER_SIZE) as process:
+        num_lines = count_lines(process.stdout)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return num_lines
+
+
+def count_lines_mmap(file_name):
+    """
+    Count number of lines in an uncompressed file by memory-mapping
+    it and counting newline bytes using :py:func:`count_newlines`,
+    without copying the file contents into Python objects. A final
+    line without a trailing newline is counted.
+
+    :param file_name: File name
+    :type file_name: str or unicode
+    :return: number of lines
+    :rtype: int
+    """
+    if os.path.getsize(file_name) == 0:
+        # Empty files cannot be memory-mapped.
+        return 0
+    with open(file_name, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = np.frombuffer(mm, dtype=np.uint8)
+        try:
+            num_lines = 0
+            # Count in chunks to avoid allocating a comparison array
+            # the size of the file.
+            for start in range(0, len(data), READ_BUFFER_SIZE):
+                num_lines += count_newlines(
+                    data[start:start + READ_BUFFER_SIZE])
+            if data[-1] != NEWLINE:
+                num_lines += 1
+        except BaseException as e:
+            # Release views of the buffer held by the frames of the
+            # traceback so the mmap can be closed and the error raised.
+            traceback.clear_frames(e.__traceback__)
+            raise
+        finally:
+            # Release the buffer so the mmap can be closed.
+            del data
+    return num_lines
+
+
 def count_sequences(file_name):
     """
     Count number of sequences in a FASTQ file. GZIPped FASTQ files can
     be handled too.
 
+    Sequences are counted by counting lines, assuming each FASTQ
+    record spans :py:const:`LINES_PER_RECORD` lines. Uncompressed
+    FASTQ files are counted using :py:func:`count_lines_mmap`. GZIPped
+    FASTQ files are decompressed using ``pigz``, via
+    :py:func:`count_lines_piped`, if it is available, or
+    :py:func:`open_fastq` otherwise.
+
     :param file_name: File name
     :type file_name: str or unicode
     :return: number of sequences
     :rtype: int
     """
-    num_sequences = 0
-    if is_fastq_gz(file_name):
-        open_file = gzip.open
+    if not is_fastq_gz(file_name):
+        num_lines = count_lines_mmap(file_name)
+    elif shutil.which(PIGZ) is not None:
+        num_lines = count_lines_piped(file_name)
     else:
-        open_file = open
-    with open_file(file_name, "rt") as f:
-        for _ in SeqIO.parse(f, "fastq"):
-            num_sequences = num_sequences + 1
-    return num_sequences
+        with open_fastq(file_name) as f:
+            num_lines = count_lines(f)
+    return num_lines // LINES_PER_RECORD
 
 
 def equal_fastq(file1, file2):
@@ -0,0 +1,484 @@
+"""
+:py:mod:`riboviz.count_reads` tests.
+"""
+import concurrent.futures
+import os
+import shutil
+import pytest
+import yaml
+from riboviz import count_reads
+from riboviz import demultiplex_fastq
+from riboviz import fastq
+from riboviz import params
+from riboviz import sam_bam
+from riboviz import sample_sheets
+from riboviz import trim_5p_mismatch
+from riboviz import workflow_files
+from riboviz.test import data
+from riboviz.tools import demultiplex_fastq as demultiplex_fastq_tools_module
+
+FASTQ_RECORD = "@read\nACGT\n+\nIIII\n"
+""" FASTQ record. """
+SAM_HEADER = "@HD\tVN:1.0\tSO:unsorted\n@SQ\tSN:YAL001C\tLN:3543\n"
+""" SAM header. """
+
+
+@pytest.fixture(scope="function")
+def empty_count_cache():
+    """
+    Empty :py:const:`riboviz.count_reads._COUNT_CACHE` before and
+    after a test.
+    """
+    count_reads._COUNT_CACHE.clear()
+    yield
+    count_reads._COUNT_CACHE.clear()
+
+
+def test_count_reads_df_count_cache(tmpdir, empty_count_cache):
+    """
+    Test :py:func:`riboviz.count_reads.count_reads_df` caches read
+    counts, made by worker processes, in the calling process and
+    reuses these counts, in worker processes, if a file's modification
+    time and size are unchanged.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param empty_count_cache: Empty count cache (fixture)
+    :type empty_count_cache: NoneType
+    """
+    input_dir = tmpdir.mkdir("input")
+    tmp_dir = tmpdir.mkdir("tmp")
+    output_dir = tmpdir.mkdir("output")
+    config_file = tmpdir.join("config.yaml")
+    config_file.write(yaml.dump({params.FQ_FILES:
+                                 {"WT": "WT.fastq"}}))
+    fq_file = input_dir.join("WT.fastq")
+    fq_file.write(FASTQ_RECORD * 2)
+    df = count_reads.count_reads_df(str(config_file), str(input_dir),
+                                    str(tmp_dir), str(output_dir))
+    assert list(df[count_reads.NUM_READS]) == [2]
+    assert count_reads._COUNT_CACHE
+    # Replace the file's content, keeping its size and modification
+    # time, so that only a cached count can be 2.
+    stat = os.stat(str(fq_file))
+    fq_file.write(FASTQ_RECORD + FASTQ_RECORD.replace("\n", " "))
+    os.utime(str(fq_file), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    df = count_reads.count_reads_df(str(config_file), str(input_dir),
+                                    str(tmp_dir), str(output_dir))
+    assert list(df[count_reads.NUM_READS]) == [2]
+
+
+def test_count_reads_df_trim_5p_mismatch_tsv(tmpdir, empty_count_cache):
+    """
+    Test :py:func:`riboviz.count_reads.count_reads_df` with samples
+    whose ``trim_5p_mismatch.tsv`` files are parsed, in this process,
+    while FASTQ files are counted by worker processes, whose counts
+    are merged into :py:const:`riboviz.count_reads._COUNT_CACHE`.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param empty_count_cache: Empty count cache (fixture)
+    :type empty_count_cache: NoneType
+    """
+    input_dir = tmpdir.mkdir("input")
+    tmp_dir = tmpdir.mkdir("tmp")
+    output_dir = tmpdir.mkdir("output")
+    samples = ["WT{}".format(i) for i in range(8)]
+    for num_reads, sample in enumerate(samples, 1):
+        sample_dir = tmp_dir.mkdir(sample)
+        sample_dir.join(workflow_files.ADAPTER_TRIM_FQ).write(
+            FASTQ_RECORD * num_reads)
+        sample_dir.join(workflow_files.NON_RRNA_FQ).write(
+            FASTQ_RECORD * num_reads)
+        sample_dir.join(workflow_files.ORF_MAP_CLEAN_SAM).write(
+            SAM_HEADER)
+        sample_dir.join(workflow_files.TRIM_5P_MISMATCH_TSV).write(
+            trim_5p_mismatch.NUM_WRITTEN + "\n" + str(num_reads) + "\n")
+    config_file = tmpdir.join("config.yaml")
+    config_file.write(yaml.dump({}))
+    df = count_reads.count_reads_df(str(config_file), str(input_dir),
+                                    str(tmp_dir), str(output_dir))
+    num_reads = [i for i in range(1, len(samples) + 1) for _ in range(3)]
+    assert list(df[count_reads.SAMPLE_NAME]) == \
+        [sample for sample in samples for _ in range(3)]
+    assert list(df[count_reads.NUM_READS]) == num_reads
+    assert len(count_reads._COUNT_CACHE) == 2 * len(samples)
+
+
+def test_count_reads_df_row_order(tmpdir, empty_count_cache):
+    """
+    Test :py:func:`riboviz.count_reads.count_reads_df` returns rows,
+    which are collected as counting tasks complete, in the order:
+    input files, multiplexed ``cutadapt`` output, demultiplexed FASTQ
+    files (counted as there is no ``num_reads.tsv`` file), then each
+    sample's files in workflow order.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param empty_count_cache: Empty count cache (fixture)
+    :type empty_count_cache: NoneType
+    """
+    input_dir = tmpdir.mkdir("input")
+    tmp_dir = tmpdir.mkdir("tmp")
+    output_dir = tmpdir.mkdir("output")
+    sam_file = os.path.join(os.path.dirname(data.__file__),
+                            "WTnone_rRNA_map_20.sam")
+    bam_file = os.path.join(os.path.dirname(data.__file__),
+                            "WTnone_rRNA_map_6_primary.bam")
+    samples = ["WTa", "WTb", "WTc"]
+    config_file = tmpdir.join("config.yaml")
+    config_file.write(yaml.dump({params.FQ_FILES: {
+        sample: sample + ".fastq" for sample in samples}}))
+    expected = []
+    for num_reads, sample in enumerate(samples, 1):
+        fq_file = input_dir.join(sample + ".fastq")
+        fq_file.write(FASTQ_RECORD * num_reads)
+        expected.append((sample, str(fq_file), num_reads))
+    fq_file = tmp_dir.join(
+        workflow_files.ADAPTER_TRIM_FQ_FORMAT.format("multiplex"))
+    fq_file.write(FASTQ_RECORD * 9)
+    expected.append(("", str(fq_file), 9))
+    deplex_dir = tmp_dir.mkdir(
+        workflow_files.DEPLEX_DIR_FORMAT.format("multiplex"))
+    # Write larger files first so they are likely to complete last.
+    for num_reads, tag in reversed(list(enumerate(
+            ["Tag0", "Tag1", "Tag2", "Tag3"], 1))):
+        deplex_dir.join(tag + ".fastq").write(
+            FASTQ_RECORD * num_reads * 1000)
+    for num_reads, tag in enumerate(["Tag0", "Tag1", "Tag2", "Tag3"], 1):
+        expected.append((tag, str(deplex_dir.join(tag + ".fastq")),
+                         num_reads * 1000))
+    for num_reads, sample in enumerate(samples, 1):
+        sample_dir = tmp_dir.mkdir(sample)
+        for file_name in [workflow_files.ADAPTER_TRIM_FQ,
+                          workflow_files.NON_RRNA_FQ,
+                          workflow_files.RRNA_MAP_SAM,
+                          workflow_files.UNALIGNED_FQ,
+                          workflow_files.ORF_MAP_SAM,
+                          workflow_files.ORF_MAP_CLEAN_SAM]:
+            if sam_bam.is_sam(file_name):
+                shutil.copyfile(sam_file, str(sample_dir.join(file_name)))
+                expected.append((sample, str(sample_dir.join(file_name)),
+                                 20))
+            else:
+                sample_dir.join(file_name).write(FASTQ_RECORD * num_reads)
+                expected.append((sample, str(sample_dir.join(file_name)),
+                                 num_reads))
+        sample_dir.join(workflow_files.DEDUP_BAM).write("")
+        dedup_file = output_dir.mkdir(sample).join(
+            sam_bam.BAM_FORMAT.format(sample))
+        shutil.copyfile(bam_file, str(dedup_file))
+        expected.append((sample, str(dedup_file), 6))
+    df = count_reads.count_reads_df(str(config_file), str(input_dir),
+                                    str(tmp_dir), str(output_dir))
+    actual = list(zip(df[count_reads.SAMPLE_NAME],
+                      df[count_reads.FILE],
+                      df[count_reads.NUM_READS]))
+    assert actual == expected
+
+
+def test_call_counting(tmpdir, empty_count_cache):
+    """
+    Test :py:func:`riboviz.count_reads._call_counting` returns only
+    the read counts cached by the function it calls.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param empty_count_cache: Empty count cache (fixture)
+    :type empty_count_cache: NoneType
+    """
+    cached_file = tmpdir.join("cached.fastq")
+    cached_file.write(FASTQ_RECORD)
+    fq_file = tmpdir.join("reads.fastq")
+    fq_file.write(FASTQ_RECORD * 2)
+    count_reads._count_cached(str(cached_file))
+    num_reads, counts = count_reads._call_counting(
+        count_reads._count_cached, str(fq_file))
+    assert num_reads == 2
+    assert list(counts) == [(fastq.count_sequences, str(fq_file))]
+    assert counts.items() <= count_reads._COUNT_CACHE.items()
+    assert count_reads._TASK_COUNTS is None
+
+
+@pytest.mark.parametrize("file_name",
+                         ["WTnone_rRNA_map_20.sam",
+                          "WTnone_rRNA_map_20.bam",
+                          "WTnone_rRNA_map_6_primary.sam",
+                          "WTnone_rRNA_map_6_primary.bam",
+                          "WTnone_rRNA_map_14_secondary.sam",
+                          "WTnone_rRNA_map_14_secondary.bam",
+                          "trim_5p_mismatch.sam",
+                          "trim_5pos5neg.sam"])
+def test_count_sam_fast(file_name):
+    """
+    Test :py:func:`riboviz.count_reads._count_sam_fast` counts the
+    same number of sequences as
+    :py:func:`riboviz.sam_bam.count_sequences`.
+
+    :param file_name: SAM/BAM file name
+    :type file_name: str or unicode
+    """
+    sam_bam_file = os.path.join(os.path.dirname(data.__file__),
+                                file_name)
+    num_sequences, _ = sam_bam.count_sequences(sam_bam_file)
+    assert count_reads._count_sam_fast(sam_bam_file)[0] == num_sequences
+
+
+def test_count_sam_fast_header_only(tmpdir):
+    """
+    Test :py:func:`riboviz.count_reads._count_sam_fast` with a SAM
+    file with a header only.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    sam_file = tmpdir.join("header.sam")
+    sam_file.write(SAM_HEADER)
+    num_sequences, _ = sam_bam.count_sequences(str(sam_file))
+    assert num_sequences == 0
+    assert count_reads._count_sam_fast(str(sam_file))[0] == num_sequences
+
+
+def test_count_sam_fast_empty(tmpdir):
+    """
+    Test :py:func:`riboviz.count_reads._count_sam_fast` with an
+    empty SAM file.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    sam_file = tmpdir.join("empty.sam")
+    sam_file.write("")
+    assert count_reads._count_sam_fast(str(sam_file))[0] == 0
+
+
+def test_umi_tools_deplex_fq_missing_tag(tmpdir):
+    """
+    Test :py:func:`riboviz.count_reads.umi_tools_deplex_fq` with a
+    ``num_reads.tsv`` file which is missing a tag, returns exactly
+    one row for each FASTQ file, with reads counted from the FASTQ
+    files.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    deplex_dir = tmpdir.mkdir(
+        workflow_files.DEPLEX_DIR_FORMAT.format("multiplex"))
+    tag0_file = deplex_dir.join("Tag0.fastq")
+    tag0_file.write(FASTQ_RECORD * 2)
+    tag1_file = deplex_dir.join("Tag1.fastq")
+    tag1_file.write(FASTQ_RECORD * 3)
+    num_reads_file = deplex_dir.join(demultiplex_fastq.NUM_READS_FILE)
+    num_reads_file.write("\t".join([sample_sheets.SAMPLE_ID,
+                                    sample_sheets.TAG_READ,
+                                    sample_sheets.NUM_READS]) + "\n" +
+                         "Tag0\tACG\t2\n")
+    rows = count_reads.umi_tools_deplex_fq(str(tmpdir))
+    program = demultiplex_fastq_tools_module.__name__
+    description = "Demultiplexed reads"
+    assert rows == [("Tag0", program, str(tag0_file), 2, description),
+                    ("Tag1", program, str(tag1_file), 3, description)]
+
+
+def test_umi_tools_deplex_fq_pool(tmpdir, empty_count_cache):
+    """
+    Test :py:func:`riboviz.count_reads.umi_tools_deplex_fq` with a
+    pool returns a future for each FASTQ file, when there is no
+    ``num_reads.tsv`` file, and that the result for a FASTQ file
+    which cannot be counted is ``None``, and that
+    :py:func:`riboviz.count_reads.count_reads_df` drops this result.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    :param empty_count_cache: Empty count cache (fixture)
+    :type empty_count_cache: NoneType
+    """
+    deplex_dir = tmpdir.mkdir(
+        workflow_files.DEPLEX_DIR_FORMAT.format("multiplex"))
+    tag0_file = deplex_dir.join("Tag0.fastq")
+    tag0_file.write(FASTQ_RECORD * 2)
+    # A directory, so cannot be counted.
+    deplex_dir.mkdir("Tag1.fastq")
+    tag2_file = deplex_dir.join("Tag2.fastq")
+    tag2_file.write(FASTQ_RECORD * 3)
+    with concurrent.futures.ProcessPoolExecutor() as pool:
+        futures = count_reads.umi_tools_deplex_fq(str(tmpdir), pool)
+        assert all(isinstance(future, concurrent.futures.Future)
+                   for future in futures)
+        rows = [future.result() for future in futures]
+    program = demultiplex_fastq_tools_module.__name__
+    description = "Demultiplexed reads"
+    assert rows == [("Tag0", program, str(tag0_file), 2, description),
+                    None,
+                    ("Tag2", program, str(tag2_file), 3, description)]
+    config_file = tmpdir.join("config.yaml")
+    config_file.write(yaml.dump({}))
+    df = count_reads.count_reads_df(str(config_file), str(tmpdir),
+                                    str(tmpdir), str(tmpdir))
+    assert list(df.itertuples(index=False, name=None)) == \
+        [row for row in rows if row is not None]
+
+
+def test_scan_sample_dir(tmpdir):
+    """
+    Test :py:func:`riboviz.count_reads._scan_sample_dir` groups
+    files by suffix, for adapter-trimmed and UMI-extracted FASTQ
+    files, and by exact name otherwise.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    sample_dir = tmpdir.mkdir("WT")
+    for file_name in [workflow_files.ADAPTER_TRIM_FQ,
+                      workflow_files.UMI_EXTRACT_FQ,
+                      workflow_files.NON_RRNA_FQ,
+                      "old_" + workflow_files.NON_RRNA_FQ,
+                      workflow_files.DEDUP_BAM,
+                      "old_" + workflow_files.DEDUP_BAM]:
+        sample_dir.join(file_name).write("")
+    sample_files = count_reads._scan_sample_dir(str(tmpdir), "WT")
+    assert sample_files[workflow_files.ADAPTER_TRIM_FQ] == \
+        [str(sample_dir.join(workflow_files.UMI_EXTRACT_FQ)),
+         str(sample_dir.join(workflow_files.ADAPTER_TRIM_FQ))]
+    assert sample_files[workflow_files.UMI_EXTRACT_FQ] == \
+        [str(sample_dir.join(workflow_files.UMI_EXTRACT_FQ))]
+    assert sample_files[workflow_files.NON_RRNA_FQ] == \
+        [str(sample_dir.join(workflow_files.NON_RRNA_FQ))]
+    assert sample_files[workflow_files.DEDUP_BAM] == \
+        [str(sample_dir.join(workflow_files.DEDUP_BAM))]
+    assert sample_files[workflow_files.ORF_MAP_SAM] == []
+
+
+def test_scan_sample_dir_multiplex(tmpdir):
+    """
+    Test :py:func:`riboviz.count_reads._scan_sample_dir`, with no
+    sample, groups multiplexed adapter-trimmed and UMI-extracted
+    FASTQ files in the directory by suffix.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    trim_file = tmpdir.join(
+        workflow_files.ADAPTER_TRIM_FQ_FORMAT.format("multiplex"))
+    trim_file.write("")
+    umi_file = tmpdir.join(
+        workflow_files.UMI_EXTRACT_FQ_FORMAT.format("multiplex"))
+    umi_file.write("")
+    sample_files = count_reads._scan_sample_dir(str(tmpdir))
+    assert sample_files[workflow_files.ADAPTER_TRIM_FQ] == \
+        [str(umi_file), str(trim_file)]
+    assert sample_files[workflow_files.UMI_EXTRACT_FQ] == [str(umi_file)]
+
+
+def test_scan_sample_dir_no_such_sample(tmpdir):
+    """
+    Test :py:func:`riboviz.count_reads._scan_sample_dir` with a
+    sample directory that does not exist returns empty groups.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    sample_files = count_reads._scan_sample_dir(str(tmpdir), "WT")
+    assert set(sample_files) == set(count_reads._SAMPLE_FILE_SUFFIXES +
+                                    count_reads._SAMPLE_FILE_NAMES)
+    assert all(files == [] for files in sample_files.values())
+
+
+def test_config_samples_fq_files():
+    """
+    Test :py:func:`riboviz.count_reads.config_samples` with
+    ``fq_files`` only returns the sorted sample names.
+    """
+    config = {params.FQ_FILES: {"WTnone": "WTnone.fastq.gz",
+                                "WT3AT": "WT3AT.fastq.gz"}}
+    assert count_reads.config_samples(config, "input") == \
+        ["WT3AT", "WTnone"]
+
+
+def test_config_samples_sample_sheet(tmpdir):
+    """
+    Test :py:func:`riboviz.count_reads.config_samples` with
+    ``multiplex_fq_files`` and ``sample_sheet`` returns the sorted
+    sample names from the sample sheet.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    sample_sheet_file = tmpdir.join("barcodes.tsv")
+    sample_sheet_file.write("# Comment\n" +
+                            "\t".join([sample_sheets.SAMPLE_ID,
+                                       sample_sheets.TAG_READ]) + "\n" +
+                            "Tag1\tGAC\nTag0\tACG\n")
+    config = {params.MULTIPLEX_FQ_FILES: ["multiplex.fastq"],
+              params.SAMPLE_SHEET: "barcodes.tsv"}
+    assert count_reads.config_samples(config, str(tmpdir)) == \
+        ["Tag0", "Tag1"]
+
+
+def test_config_samples_unreadable_sample_sheet(tmpdir):
+    """
+    Test :py:func:`riboviz.count_reads.config_samples` with a
+    ``sample_sheet`` that cannot be read returns ``None``.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    config = {params.FQ_FILES: {"WTnone": "WTnone.fastq.gz"},
+              params.MULTIPLEX_FQ_FILES: ["multiplex.fastq"],
+              params.SAMPLE_SHEET: "missing.tsv"}
+    assert count_reads.config_samples(config, str(tmpdir)) is None
+
+
+def write_read_counts(file_name, rows):
+    """
+    Write a read counts file, with a comment line and header.
+
+    :param file_name: File name
+    :type file_name: py._path.local.LocalPath
+    :param rows: Rows
+    :type rows: list(tuple)
+    """
+    lines = ["# Created by: riboviz", "\t".join(count_reads.HEADER)]
+    lines.extend("\t".join(str(value) for value in row) for row in rows)
+    file_name.write("\n".join(lines) + "\n")
+
+
+def test_equal_read_counts_multiplex(tmpdir):
+    """
+    Test :py:func:`riboviz.count_reads.equal_read_counts` with files
+    which contain a multiplexed input row, whose ``SampleName`` is
+    empty, and whose ``File`` values differ only in their paths.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    for directory in ["a", "b"]:
+        write_read_counts(
+            tmpdir.join(directory + ".tsv"),
+            [("", count_reads.INPUT,
+              directory + "/input/multiplex.fastq", 90,
+              count_reads.INPUT),
+             ("Tag0", demultiplex_fastq_tools_module.__name__,
+              directory + "/tmp/multiplex_deplex/Tag0.fastq", 27,
+              "Demultiplexed reads")])
+    count_reads.equal_read_counts(str(tmpdir.join("a.tsv")),
+                                  str(tmpdir.join("b.tsv")))
+
+
+def test_equal_read_counts_different_num_reads(tmpdir):
+    """
+    Test :py:func:`riboviz.count_reads.equal_read_counts` with files
+    which differ in a ``NumReads`` value raises an error.
+
+    :param tmpdir: Temporary directory (pytest built-in fixture)
+    :type tmpdir: py._path.local.LocalPath
+    """
+    for file_name, num_reads in [("a.tsv", 90), ("b.tsv", 91)]:
+        write_read_counts(
+            tmpdir.join(file_name),
+            [("", count_reads.INPUT, "input/multiplex.fastq",
+              num_reads, count_reads.INPUT)])
+    with pytest.raises(AssertionError) as exception:
+        count_reads.equal_read_counts(str(tmpdir.join("a.tsv")),
+                                      str(tmpdir.join("b.tsv")))
+    assert count_reads.NUM_READS in str(exception.value)
@@ -4,8 +4,10 @@
 import gzip
 import itertools
 import os
+import shutil
 import tempfile
 import pytest
+import numpy as np
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
@@ -177,3 +179,105 @@ def test_count_sequences_gz(tmp_gz_file, count):
     with gzip.open(tmp_gz_file, "wt") as f:
         SeqIO.write(sequences, f, "fastq")
     assert fastq.count_sequences(tmp_gz_file) == count
+
+
+@pytest.mark.skipif(shutil.which(fastq.PIGZ) is None,
+                    reason="pigz is not available")
+@pytest.mark.parametrize("count", [0, 1, 10])
+def test_count_lines_piped(tmp_gz_file, count):
+    """
+    Test :py:func:`riboviz.fastq.count_lines_piped` with GZIPped FASTQ
+    files.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    :param count: Number of sequences
+    :type count: int
+    """
+    sequences = get_test_fastq_sequences(4, count)
+    with gzip.open(tmp_gz_file, "wt") as f:
+        SeqIO.write(sequences, f, "fastq")
+    assert fastq.count_lines_piped(tmp_gz_file) == \
+        count * fastq.LINES_PER_RECORD
+
+
+@pytest.mark.parametrize("count", [0, 1, 10])
+def test_count_sequences_gz_isal(tmp_gz_file, count, monkeypatch):
+    """
+    Test :py:func:`riboviz.fastq.count_sequences` with GZIPped FASTQ
+    files, when ``pigz`` is not available, decompresses the files
+    using ``isal.igzip``.
+
+    :param tmp_gz_file: path to temporary file
+    :type tmp_gz_file: str or unicode
+    :param count: Number of sequences
+    :type count: int
+    :param monkeypatch: Monkeypatch (pytest built-in fixture)
+    :type monkeypatch: _pytest.monkeypatch.MonkeyPatch
+    """
+    igzip = pytest.importorskip("isal.igzip")
+    sequences = get_test_fastq_sequences(4, count)
+    with gzip.open(tmp_gz_file, "wt") as f:
+        SeqIO.write(sequences, f, "fastq")
+    with fastq.open_fastq(tmp_gz_file) as f:
+        assert isinstance(f, igzip.IGzipFile)
+    monkeypatch.setattr(fastq, "PIGZ", "no-such-pigz")
+    assert fastq.count_sequences(tmp_gz_file) == count
+
+
+def test_count_sequences_no_trailing_newline(tmp_file):
+    """
+    Test :py:func:`riboviz.fastq.count_sequences` with a FASTQ file
+    whose final line has no trailing newline.
+
+    :param tmp_file: path to temporary file
+    :type tmp_file: str or unicode
+    """
+    sequences = get_test_fastq_sequences(4, 2)
+    with open(tmp_file, "wt") as f:
+        SeqIO.write(sequences, f, "fastq")
+    with open(tmp_file, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        f.truncate()
+    assert fastq.count_sequences(tmp_file) == 2
+
+
+def test_count_lines_mmap_error(tmp_file, monkeypatch):
+    """
+    Test :py:func:`riboviz.fastq.count_lines_mmap` raises the error
+    raised when counting newlines, rather than an error from closing
+    the memory-mapped file.
+
+    :param tmp_file: path to temporary file
+    :type tmp_file: str or unicode
+    :param monkeypatch: Monkeypatch (pytest built-in fixture)
+    :type monkeypatch: _pytest.monkeypatch.MonkeyPatch
+    """
+    def count_newlines(buffer):
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        raise ValueError(len(data))
+
+    sequences = get_test_fastq_sequences(4, 2)
+    with open(tmp_file, "wt") as f:
+        SeqIO.write(sequences, f, "fastq")
+    monkeypatch.setattr(fastq, "count_newlines", count_newlines)
+    with pytest.raises(ValueError):
+        fastq.count_lines_mmap(tmp_file)
+
+
+@pytest.mark.parametrize("buffer,count", [(b"", 0),
+                                          (b"ACGT", 0),
+                                          (b"ACGT\n", 1),
+                                          (b"\n\nACGT\n+\n", 4)])
+def test_count_newlines(buffer, count):
+    """
+    Test :py:func:`riboviz.fastq.count_newlines` with bytes and
+    memoryview buffers.
+
+    :param buffer: Buffer
+    :type buffer: bytes
+    :param count: Number of newlines
+    :type count: int
+    """
+    assert fastq.count_newlines(buffer) == count
+    assert fastq.count_newlines(memoryview(bytearray(buffer))) == count
@@ -50,6 +50,8 @@ See :py:func:`riboviz.count_reads.count_reads` for information on what
 files are read and how the reads are counted.
 """
 import argparse
+import logging
+import sys
 from riboviz import count_reads
 from riboviz import provenance
 
@@ -95,9 +97,13 @@ def parse_command_line_options():
 def invoke_count_reads():
     """
     Parse command-line options then invoke
-    :py:func:`riboviz.count_reads.count_reads`.
+    :py:func:`riboviz.count_reads.count_reads`. Messages logged by
+    :py:mod:`riboviz.count_reads` are printed to standard output.
     """
     print(provenance.write_provenance_to_str(__file__))
+    logging.basicConfig(format="%(message)s",
+                        level=logging.INFO,
+                        stream=sys.stdout)
     options = parse_command_line_options()
     config_file = options.config_file
     input_dir = options.input_dir